@@ -1,27 +1,33 @@
-from os import listdir
-from os.path import isfile, join
-import string
+from os import scandir
+from concurrent.futures import ThreadPoolExecutor
+import re
+import sys
 import nltk
 from nltk.stem import PorterStemmer, WordNetLemmatizer
-from nltk.corpus import stopwords
-from nltk.tokenize import WordPunctTokenizer
-import math
+from nltk.corpus import stopwords, wordnet
+from functools import lru_cache
+from multiprocessing import get_context
+import numpy as np
+from scipy.sparse import csc_matrix, csr_matrix
 
 # -- 3. Loading the Documents --
 
 def get_all_files(folder_path):
     """Returns a list of file paths for all files in the given folder."""
-    return [join(folder_path, f) for f in listdir(folder_path) if isfile(join(folder_path, f))]
+    with scandir(folder_path) as entries:
+        return [entry.path for entry in entries if entry.is_file()]
+
+def read_file(file_path):
+    """Reads and returns the text of a single file."""
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return file.read()
 
 def load_data(folder_path):
     """Reads all .txt files in the given folder and returns a list of texts."""
-    file_paths = get_all_files(folder_path)
-    texts = []
-    for file_path in file_paths:
-        if file_path.endswith('.txt'):
-            with open(file_path, 'r', encoding='utf-8') as file:
-                texts.append(file.read())
-    return texts
+    file_paths = [file_path for file_path in get_all_files(folder_path) if file_path.endswith('.txt')]
+    # File reads release the GIL, so a thread pool overlaps the I/O
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        return list(executor.map(read_file, file_paths))
 
 # Example usage:
 # folder_path = "guinnessWorldRecords"
@@ -32,122 +38,182 @@ def load_data(folder_path):
 
 # -- 4. Text Preprocessing --
 
-nltk.download('stopwords')
-nltk.download('wordnet')
-nltk.download('omw-1.4')
+def download_missing_nltk_data():
+    """Download the NLTK data used for preprocessing, skipping packages that are already installed."""
+    for package, path in [('stopwords', 'corpora/stopwords'), ('wordnet', 'corpora/wordnet'),
+                          ('omw-1.4', 'corpora/omw-1.4')]:
+        try:
+            nltk.data.find(path)
+        except LookupError:
+            nltk.download(package, quiet=True)
+
+download_missing_nltk_data()
+
+# Built once and shared by every call to preprocess_text
+# Runs of letters and digits. Punctuation and symbols (including Unicode ones such as
+# emoji, curly quotes and invisible separators) split tokens and are never kept as tokens
+_TOKEN_RE = re.compile(r"\w+")
+_STOPWORDS = frozenset(stopwords.words('english'))
+_STEMMER = PorterStemmer()
+_LEMMATIZER = WordNetLemmatizer()
+
+@lru_cache(maxsize=None)
+def _normalize_token(token):
+    """Stem and lemmatize a token; cached since the same words recur across documents."""
+    return _LEMMATIZER.lemmatize(_STEMMER.stem(token))
 
 def preprocess_text(text):
-    # Convert to lowercase
-    text = text.lower()
-    # Tokenize
-    tokens = WordPunctTokenizer().tokenize(text)
-    # Remove punctuation
-    tokens = [t.translate(str.maketrans('', '', string.punctuation)) for t in tokens]
-    tokens = [t for t in tokens if t]  # Remove empty tokens
-    # Remove stopwords
-    tokens = [t for t in tokens if t not in stopwords.words('english')]
-    # Stemming
-    ps = PorterStemmer()
-    tokens = [ps.stem(t) for t in tokens]
-    # Lemmatization
-    lemmatizer = WordNetLemmatizer()
-    tokens = [lemmatizer.lemmatize(t) for t in tokens]
-    return tokens
+    # Lowercase and tokenize, leaving out punctuation; underscores are removed
+    # rather than splitting, so "foo_bar" stays one token "foobar"
+    tokens = _TOKEN_RE.findall(text.lower().replace('_', ''))
+    # Remove stopwords, then stem and lemmatize
+    return [_normalize_token(t) for t in tokens if t not in _STOPWORDS]
 
 # Example:
 # print(preprocess_text("The BOYS are jumping on the trampoline."))
 # Output: ['boy', 'jump', 'trampolin']
 
-def preprocess_docs(docs):
-    """Apply preprocess_text to each document in docs."""
-    return [preprocess_text(doc) for doc in docs]
+def preprocess_docs(docs, processes=1):
+    """Apply preprocess_text to each document in docs; processes > 1 (or None for all CPU cores) forks workers."""
+    # Parallelism is opt-in and Linux-only: workers are forked so they inherit the loaded NLTK data,
+    # and fork is unsafe on macOS and in multi-threaded hosts such as notebook kernels
+    if processes == 1 or not sys.platform.startswith('linux'):
+        return [preprocess_text(doc) for doc in docs]
+    # Load WordNet before forking so the workers share it instead of each loading a copy
+    wordnet.ensure_loaded()
+    # The workers' _normalize_token caches are discarded with the pool, so the parent's cache
+    # is still cold afterwards and fills up as queries are preprocessed
+    with get_context('fork').Pool(processes) as pool:
+        return list(pool.imap(preprocess_text, docs, chunksize=64))
 
 # processed_docs = preprocess_docs(docs)
 
 
-# -- 5. TF-IDF Computation --
-
-def calc_tf(token, tokens_of_document):
-    """Term Frequency for a token in a document."""
-    return tokens_of_document.count(token) / len(tokens_of_document)
-
-def calc_idf(token, list_of_tokens_docs):
-    """Inverse Document Frequency for a token across all documents."""
-    freq_token = sum(1 for doc in list_of_tokens_docs if token in doc)
-    return math.log10(len(list_of_tokens_docs) / freq_token) if freq_token else 0
-
-def calc_tf_idf(token, tokens_doc, list_of_tokens_docs):
-    return calc_tf(token, tokens_doc) * calc_idf(token, list_of_tokens_docs)
-
-def calc_tf_idf_doc(tokens_doc, list_of_tokens_docs):
-    """TF-IDF dictionary for a single document."""
-    tf_idf_doc = {}
-    for token in set(tokens_doc):
-        tf_idf_doc[token] = calc_tf_idf(token, tokens_doc, list_of_tokens_docs)
-    return tf_idf_doc
-
-def calc_tf_idf_all_docs(list_of_tokens_docs):
-    """TF-IDF dictionaries for all documents."""
-    return [calc_tf_idf_doc(tokens_doc, list_of_tokens_docs) for tokens_doc in list_of_tokens_docs]
-
-# tfidf_docs = calc_tf_idf_all_docs(processed_docs)
+# -- 5. BM25 Weights --
+
+def intern_tokens(list_of_tokens_docs):
+    """Give every token an integer id; returns the vocab and each document as an int32 array of ids."""
+    vocab = {}
+    token_ids_docs = [np.fromiter((vocab.setdefault(token, len(vocab)) for token in tokens_doc),
+                                  dtype=np.int32, count=len(tokens_doc))
+                      for tokens_doc in list_of_tokens_docs]
+    return vocab, token_ids_docs
+
+def calc_idf_all_tokens(token_counts_docs, vocab_size):
+    """BM25 Inverse Document Frequency for every token id, from the unique token ids of all documents."""
+    doc_freq = np.bincount(np.concatenate([ids for ids, counts in token_counts_docs]), minlength=vocab_size)
+    return np.log1p((len(token_counts_docs) - doc_freq + 0.5) / (doc_freq + 0.5))
+
+def calc_bm25_doc(token_counts, idf, avg_doc_len, k1, b):
+    """BM25 weights for a single document, given its unique token ids with their counts."""
+    ids, counts = token_counts
+    length_norm = k1 * (1 - b + b * counts.sum() / avg_doc_len)
+    return idf[ids] * counts * (k1 + 1) / (counts + length_norm)
+
+def calc_bm25_all_docs(token_ids_docs, vocab_size, k1=1.5, b=0.75):
+    """Sparse float32 BM25 matrix for all documents: one row per document, one column per token id."""
+    if not token_ids_docs:
+        return csc_matrix((0, vocab_size), dtype=np.float32)
+    token_counts_docs = [np.unique(token_ids_doc, return_counts=True) for token_ids_doc in token_ids_docs]
+    idf = calc_idf_all_tokens(token_counts_docs, vocab_size)
+    # If every document is empty there are no weights to normalise, so avoid dividing by 0
+    avg_doc_len = np.mean([len(token_ids_doc) for token_ids_doc in token_ids_docs]) or 1
+    data = np.concatenate([calc_bm25_doc(token_counts, idf, avg_doc_len, k1, b)
+                           for token_counts in token_counts_docs])
+    indices = np.concatenate([ids for ids, counts in token_counts_docs])
+    indptr = np.cumsum([0] + [len(ids) for ids, counts in token_counts_docs])
+    bm25_docs = csr_matrix((data.astype(np.float32), indices, indptr), shape=(len(token_ids_docs), vocab_size))
+    # Stored column-major (CSC) so each token's column is its postings list,
+    # and scoring a query only reads the postings of the query tokens
+    return bm25_docs.tocsc()
+
+# vocab, token_ids_docs = intern_tokens(processed_docs)
+# bm25_docs = calc_bm25_all_docs(token_ids_docs, len(vocab))
 
 
 # -- 6. User Query Processing --
 
+@lru_cache(maxsize=4096)
 def preprocess_user_query(query):
-    return preprocess_text(query)
+    """Query tokens as a tuple, cached so repeated queries skip preprocessing."""
+    return tuple(preprocess_text(query))
 
 # Example:
 # print(preprocess_user_query("Who is the tallest DOG in the world?"))
-# Output: ['tallest', 'dog', 'world']
+# Output: ('tallest', 'dog', 'world')
 
 
 # -- 7. Document Scoring --
 
-def calc_score_doc(tf_idf_doc, query_tokens):
-    """Sum the TF-IDF scores for the query tokens in a single document."""
-    return sum(tf_idf_doc.get(token, 0) for token in query_tokens)
+def calc_query_matrix(list_of_query_tokens, vocab):
+    """Sparse matrix with one column per query, counting how often each vocab token occurs in it."""
+    token_ids, query_ids = [], []
+    for query_index, query_tokens in enumerate(list_of_query_tokens):
+        ids = [vocab[token] for token in query_tokens if token in vocab]
+        token_ids.extend(ids)
+        query_ids.extend([query_index] * len(ids))
+    counts = np.ones(len(token_ids), dtype=np.float32)
+    return csc_matrix((counts, (token_ids, query_ids)), shape=(len(vocab), len(list_of_query_tokens)))
 
-def calc_scores_docs(tf_idf_docs, query_tokens):
-    """Return a list of scores for all documents."""
-    return [calc_score_doc(tf_idf_doc, query_tokens) for tf_idf_doc in tf_idf_docs]
+def calc_scores_queries(bm25_docs, list_of_query_tokens, vocab):
+    """Return a (documents x queries) array of scores, computed for all queries in one sparse product."""
+    return (bm25_docs @ calc_query_matrix(list_of_query_tokens, vocab)).toarray()
+
+def calc_scores_docs(bm25_docs, query_tokens, vocab):
+    """Return an array with the summed BM25 weights of the query tokens in every document."""
+    return calc_scores_queries(bm25_docs, [query_tokens], vocab)[:, 0]
 
 # Example:
-# tf_idf_docs_example = [{"test": 0.22, "doc": 0.013, "1": 0.1}, {"test": 0.4, "doc": 0.02, "2": 0.9}]
+# vocab_example = {"1": 0, "2": 1, "doc": 2, "test": 3}
+# bm25_docs_example = csc_matrix([[0.1, 0, 0.013, 0.22], [0, 0.9, 0.02, 0.4]])
 # query_tokens_example = ["best", "doc"]
-# print(calc_scores_docs(tf_idf_docs_example, query_tokens_example))
-# Output: [0.013, 0.02]
+# print(calc_scores_docs(bm25_docs_example, query_tokens_example, vocab_example))
+# Output: [0.013 0.02 ]
 
 
 # -- 8. Ranking and Retrieving Results --
 
 def rank_docs(docs, scores_docs, top_n=5):
     """Return the top_n documents with the highest scores."""
-    combined = list(zip(docs, scores_docs))
-    sorted_combined = sorted(combined, key=lambda x: x[1], reverse=True)
-    return [doc for doc, score in sorted_combined[:top_n]]
+    scores_docs = np.asarray(scores_docs)
+    top_n = min(top_n, len(scores_docs))
+    if top_n <= 0:
+        return []
+    # Partial selection of the top_n-th highest score instead of a full sort;
+    # ties are broken by document order, as a stable sort would
+    threshold = np.partition(scores_docs, len(scores_docs) - top_n)[len(scores_docs) - top_n]
+    above = np.flatnonzero(scores_docs > threshold)
+    tied = np.flatnonzero(scores_docs == threshold)[:top_n - len(above)]
+    top = np.concatenate((above, tied))
+    top = top[np.lexsort((top, -scores_docs[top]))]
+    return [docs[i] for i in top]
 
 
 # -- 9. Full Search Workflow Example --
 
-def search(search_question, tf_idf_per_doc, docs):
+def search(search_question, bm25_per_doc, vocab, docs):
     query_tokens = preprocess_user_query(search_question)
-    scores = calc_scores_docs(tf_idf_per_doc, query_tokens)
+    scores = calc_scores_docs(bm25_per_doc, query_tokens, vocab)
     return rank_docs(docs, scores, top_n=5)
 
+def search_many(search_questions, bm25_per_doc, vocab, docs):
+    """Run several searches at once, scoring all of the queries in a single pass over the index."""
+    queries_tokens = [preprocess_user_query(search_question) for search_question in search_questions]
+    scores = calc_scores_queries(bm25_per_doc, queries_tokens, vocab)
+    return [rank_docs(docs, scores[:, query_index], top_n=5) for query_index in range(len(queries_tokens))]
+
 # Example usage:
 # search_question = "Who is the tallest DOG in the world?"
-# top_results = search(search_question, tfidf_docs, docs)
+# top_results = search(search_question, bm25_docs, vocab, docs)
 # for idx, res in enumerate(top_results, 1):
 #     print(f"{idx}. {res}\n")
 
 # --- Real Input/Output Example ---
 
 # search_question = "What is the name of the person with the largest collection of Pepsi cans in the world?" #@param {type:"string"}
-# output = search(search_question, tfidf_docs, docs)
+# output = search(search_question, bm25_docs, vocab, docs)
 # print(output)
-# Expected Output:
+# Expected Output (recorded with the earlier TF-IDF weighting):
 # [
 #     "Gary Feng from Canada has a colossal collection of 11308 rare Coca-Cola cans from around the world. Check out some of his favourites 🥤  #cola #cocacola #soda #sodacans #beverages #collector #collection #collectable #guinnessworldrecords #officiallyamazing https://www.instagram.com/p/CVNgDDtDxLr",
 #     "Davide Andreani from Italy has a collection of 10,558 @cocacola cans from 87 countries. Davide received his first Coca Cola can back in 1982 when he was just 5 years old, beginning a lifetime's obsession with the soft drink. His record was confirmed on this day in 2013.  Soon after, Davide began collecting the distinctive tins, with his father bringing him home unusual designs when returning from his European business trips.  Today, he searches the globe for can designs which only appeared in shops for a limited time or sometimes never even released to the public, including rare gold and silver coloured cans released in various countries for Christmas and special sporting events🥤 \"The most valuable cans are those produced from the factory for a special moment. Like gold cans produced for plant openings or special anniversaries. But these cans are very limited and very rare,\" the passionate collector explained, ahead of his appearance in our #GWR2015 book with the record title 'Largest collection of soft drink cans - same brand'. _________________________________________  #cocacola #collection #collectable #collector #guinnessworldrecords #officiallyamazing #italy #coke #soda #onthisday https://www.instagram.com/p/BmeZN4xnYDr",